@@ -146,12 +146,7 @@ export OS_REGION_NAME=RegionOne
         :returns: True if existing relation found, False otherwise
         :rtype: bool
         """
-        try:
-            list(filter(lambda r: charm in r.charms,
-                        relations))[0]
-            return True
-        except IndexError:
-            return False
+        return any(charm in r.charms for r in relations)
 
     @classmethod
     def name(class_):
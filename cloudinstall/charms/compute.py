@@ -39,9 +39,8 @@ class CharmNovaCompute(CharmBase):
         super(CharmNovaCompute, self).set_relations()
         juju, _ = poll_state()
         service = juju.service(self.charm_name)
-        has_amqp = list(filter(lambda r: 'amqp' in r.relation_name,
-                        service.relations))
-        if len(has_amqp) == 0:
+        has_amqp = any('amqp' in r.relation_name for r in service.relations)
+        if not has_amqp:
             log.debug("Setting amqp relation for compute.")
             ret = self.client.add_relation("{c}:amqp".format(
                                            c=self.charm_name),
@@ -19,7 +19,9 @@
 """ Pegasus - gui interface to  Installer """
 
 from operator import attrgetter
-from os import write, close, getenv
+from os import write, getenv, ttyname
+from collections import deque
+from queue import Queue
 from traceback import format_exc
 import re
 import threading
@@ -31,6 +33,13 @@ from urwid import (AttrWrap, AttrMap, Text, Columns, Overlay, LineBox,
                    SimpleListWalker, Edit, RadioButton, IntEdit,
                    MainLoop, ExitMainLoop)
 
+try:
+    import asyncio
+    from urwid import AsyncioEventLoop
+except ImportError:
+    # Python 3.3 or urwid < 1.3, stay on urwid's select based loop
+    asyncio = None
+
 from cloudinstall.juju.client import JujuClient
 from cloudinstall import pegasus
 from cloudinstall import utils
@@ -41,7 +50,11 @@ log = logging.getLogger('cloudinstall.gui')
 TITLE_TEXT = "Ubuntu Openstack Installer"
 
 # - Properties ----------------------------------------------------------------
-IS_TTY = re.match('/dev/tty[0-9]', utils.get_command_output('tty')['stdout'])
+# Same check as matching the output of tty(1), without forking it
+try:
+    IS_TTY = re.match('/dev/tty[0-9]', ttyname(0)) is not None
+except OSError:
+    IS_TTY = False
 
 # Time to lock in seconds
 LOCK_TIME = 120
@@ -62,10 +75,45 @@ STYLES = [
 
 RADIO_STATES = list(pegasus.ALLOCATION.values())
 
+# Charm classes are discovered once and shared by every caller, see
+# _get_charm_classes()
+_CHARM_CLASSES = None
+_MULTI_UNIT_CHARM_CLASSES = None
+_CHARM_CLASSES_LOCK = threading.Lock()
+
+
+def _get_charm_classes(multi_units=False):
+    """ Returns known charm classes, importing the charm modules on first use
+
+    :param bool multi_units: (optional) only return enabled charms which
+                             allow adding multiple units
+    :returns: charm classes sorted by deploy priority, or in discovery
+              order for multi unit charms
+    :rtype: list
+    """
+    global _CHARM_CLASSES, _MULTI_UNIT_CHARM_CLASSES
+    with _CHARM_CLASSES_LOCK:
+        if _CHARM_CLASSES is None:
+            charm_classes = [m.__charm_class__ for m in utils.load_charms()]
+            _MULTI_UNIT_CHARM_CLASSES = [c for c in charm_classes
+                                         if c.allow_multi_units and
+                                         not c.disabled]
+            _CHARM_CLASSES = sorted(charm_classes,
+                                    key=attrgetter('deploy_priority'))
+    if multi_units:
+        return _MULTI_UNIT_CHARM_CLASSES
+    return _CHARM_CLASSES
+
+
+@utils.async
+def _preload_charm_classes():
+    """ Fills the charm class cache in the background """
+    _get_charm_classes()
+
 
 def _allocation_for_charms(charms):
     als = [pegasus.ALLOCATION.get(c, '') for c in charms]
-    return list(filter(lambda x: x, als))
+    return [a for a in als if a]
 
 
 class ControllerOverlay(Overlay):
@@ -84,10 +132,13 @@ class ControllerOverlay(Overlay):
         self.command_runner = command_runner
         self.done = False
         self.machine = None
-        self.deployed_charm_classes = []
-        self.finalized_charm_classes = []
+        self.deployed_charm_classes = set()
+        self.finalized_charm_classes = set()
         self.single_net_configured = False
         self.lxc_root_tarball_configured = False
+        # add-machine is queued or running, see get_controller_machine()
+        self.adding_machine = False
+        self.machine_added = False
         self.info_text = Text(self.NODE_WAIT
                               if pegasus.SINGLE_SYSTEM
                               else self.PXE_BOOT)
@@ -114,17 +165,15 @@ class ControllerOverlay(Overlay):
         return continue_
 
     def _process(self, juju_state, maas_state):
-        charm_modules = utils.load_charms()
-        charm_classes = sorted([m.__charm_class__ for m in charm_modules
-                                if not m.__charm_class__.optional and
-                                not m.__charm_class__.disabled],
-                               key=attrgetter('deploy_priority'))
+        all_charm_classes = _get_charm_classes()
+        charm_classes = [c for c in all_charm_classes
+                         if not c.optional and not c.disabled]
         # Add any additional charms enabled from command line
         if self.opts.enable_swift:
-            for m in charm_modules:
-                if m.__charm_class__.name() == "swift-storage" or \
-                        m.__charm_class__.name() == "swift-proxy":
-                    charm_classes.append(m.__charm_class__)
+            for c in all_charm_classes:
+                if c.name() == "swift-storage" or \
+                        c.name() == "swift-proxy":
+                    charm_classes.append(c)
 
         if self.machine is None:
             self.machine = self.get_controller_machine(juju_state, maas_state)
@@ -144,27 +193,31 @@ class ControllerOverlay(Overlay):
                 log.debug("Copying local copy of rootfs")
                 self.configure_lxc_root_tarball(rootfs)
 
-            log.debug("starting install on "
-                      "machine {mid}".format(mid=self.machine.machine_id))
+            log.debug("starting install on machine %s",
+                      self.machine.machine_id)
 
         undeployed_charm_classes = [c for c in charm_classes
                                     if c not in self.deployed_charm_classes]
 
+        # Charms instantiated during this pass, shared by the deploy and
+        # finalize steps below
+        charms = {}
+
         if len(undeployed_charm_classes) > 0:
             self.info_text.set_text("Deploying charms")
             log.debug("Deploying charms")
+            service_names = set(s.service_name for s in juju_state.services)
             for charm_class in undeployed_charm_classes:
                 charm = charm_class(juju_state=juju_state)
-                log.debug("checking if {c} is deployed:".format(c=charm))
+                charms[charm_class] = charm
+                log.debug("checking if %s is deployed:", charm)
 
-                service_names = [s.service_name for s in juju_state.services]
                 if charm.name() in service_names:
-                    log.debug("{c} is already deployed, skipping"
-                              "".format(c=charm))
-                    self.deployed_charm_classes.append(charm_class)
+                    log.debug("%s is already deployed, skipping", charm)
+                    self.deployed_charm_classes.add(charm_class)
                     continue
 
-                log.debug("Deploying {c}".format(c=charm))
+                log.debug("Deploying %s", charm)
 
                 if charm.isolate:
                     charm.setup()
@@ -174,29 +227,34 @@ class ControllerOverlay(Overlay):
                     charm.machine_id = 'lxc:{mid}'.format(
                         mid=self.machine.machine_id)
                     charm.setup()
-                self.deployed_charm_classes.append(charm_class)
+                self.deployed_charm_classes.add(charm_class)
 
-        unfinalized_charm_classes = [c for c in self.deployed_charm_classes
-                                     if c not in self.finalized_charm_classes]
+        # Walk charm_classes rather than the deployed set to keep charms
+        # queued in deploy priority order.
+        unfinalized_charm_classes = [c for c in charm_classes
+                                     if c in self.deployed_charm_classes and
+                                     c not in self.finalized_charm_classes]
 
         charm_q = CharmQueue()
         if len(unfinalized_charm_classes) > 0:
             self.info_text.set_text("Setting charm relations "
                                     "and post processing")
             for charm_class in unfinalized_charm_classes:
-                charm = charm_class(juju_state=juju_state)
+                charm = charms.get(charm_class)
+                if charm is None:
+                    charm = charm_class(juju_state=juju_state)
                 charm_q.add_relation(charm)
                 charm_q.add_post_proc(charm)
-                self.finalized_charm_classes.append(charm_class)
+                self.finalized_charm_classes.add(charm_class)
             if not charm_q.is_running:
                 charm_q.watch_relations()
                 charm_q.watch_post_proc()
                 charm_q.is_running = True
 
-        log.debug("at end of process(), deployed_charm_classes={d}"
-                  "finalized_charm_classes={f}".format(
-                      d=self.deployed_charm_classes,
-                      f=self.finalized_charm_classes))
+        log.debug("at end of process(), deployed_charm_classes=%s"
+                  "finalized_charm_classes=%s",
+                  self.deployed_charm_classes,
+                  self.finalized_charm_classes)
 
         if len(self.finalized_charm_classes) == len(charm_classes):
             log.debug("Charm setup done.")
@@ -208,8 +266,7 @@ class ControllerOverlay(Overlay):
     def get_controller_machine(self, juju_state, maas_state):
 
         allocated = list(juju_state.machines_allocated())
-        log.debug("Allocated machines: "
-                  "{machines}".format(machines=allocated))
+        log.debug("Allocated machines: %s", allocated)
 
         if pegasus.MULTI_SYSTEM:
             maas_allocated = list(maas_state.machines_allocated())
@@ -221,7 +278,16 @@ class ControllerOverlay(Overlay):
                 return None
             elif len(allocated) == 0 and len(maas_allocated) > 0:
                 self.info_text.set_text("Adding maas machine to juju")
-                self.command_runner.add_machine()
+                if self.adding_machine:
+                    return None
+                if self.machine_added:
+                    # this state may have been polled before the machine
+                    # was added, give juju one more poll to report it
+                    self.machine_added = False
+                    return None
+                self.adding_machine = True
+                self.command_runner.add_machine(
+                    callback=self._machine_added)
                 return None
             else:
                 return self.get_started_machine(allocated)
@@ -231,6 +297,10 @@ class ControllerOverlay(Overlay):
 
         return None
 
+    def _machine_added(self, unused_out):
+        self.adding_machine = False
+        self.machine_added = True
+
     def get_started_machine(self, allocated):
         started_machines = sorted([m for m in allocated
                                    if m.agent_state == 'started'],
@@ -248,10 +318,10 @@ class ControllerOverlay(Overlay):
             self.machine.machine_id,
             src="/usr/share/cloud-installer/templates/lxc-host-only",
             dst="/tmp/lxc-host-only")
+        # run both steps through a single juju run round-trip
         utils.remote_run(self.machine.machine_id,
-                         cmds="sudo chmod +x /tmp/lxc-host-only")
-        utils.remote_run(self.machine.machine_id,
-                         cmds="sudo /tmp/lxc-host-only")
+                         cmds=("sudo chmod +x /tmp/lxc-host-only",
+                               "sudo /tmp/lxc-host-only"))
         self.single_net_configured = True
 
     def configure_lxc_root_tarball(self, rootfs):
@@ -274,10 +344,7 @@ class AddCharmDialog(Overlay):
     """ Adding charm dialog """
 
     def __init__(self, underlying, juju_state, destroy, command_runner=None):
-        charm_modules = utils.load_charms()
-        self.charm_classes = [m.__charm_class__ for m in charm_modules
-                              if m.__charm_class__.allow_multi_units and
-                              not m.__charm_class__.disabled]
+        self.charm_classes = _get_charm_classes(multi_units=True)
 
         self.juju_state = juju_state
         self.cr = command_runner
@@ -288,11 +355,12 @@ class AddCharmDialog(Overlay):
         self.bgroup = []
         first_index = 0
         for i, charm_class in enumerate(self.charm_classes):
-            charm = charm_class(juju_state=juju_state)
-            if charm.name() and not first_index:
+            # name() is a classmethod, no need for a charm instance
+            name = charm_class.name()
+            if name and not first_index:
                 first_index = i
-            r = RadioButton(self.bgroup, charm.name())
-            r.text_label = charm.name()
+            r = RadioButton(self.bgroup, name)
+            r.text_label = name
             self.boxes.append(r)
 
         self.count_editor = IntEdit("Number of units to add: ", 1)
@@ -312,15 +380,14 @@ class AddCharmDialog(Overlay):
                          'center', 45, 'middle', len(wrapped_boxes) + 4)
 
     def yes(self, button):
-        selected = [r for r in self.boxes if
-                    r is not self.count_editor
-                    and r.get_state()][0]
+        selected = next(r for r in self.boxes if
+                        r is not self.count_editor
+                        and r.get_state())
         _charm_to_deploy = selected.label
         n = self.count_editor.value()
         svc = self.juju_state.service(_charm_to_deploy)
         if svc.service:
-            log.info("Adding {n} units of {charm}".format(
-                     n=n, charm=_charm_to_deploy))
+            log.info("Adding %s units of %s", n, _charm_to_deploy)
             self.cr.add_unit(_charm_to_deploy, count=int(n))
         else:
             charm_q = CharmQueue()
@@ -338,7 +405,7 @@ class AddCharmDialog(Overlay):
                 for c in charm.related:
                     svc = self.juju_state.service(_charm_to_deploy)
                     if not svc.service:
-                        log.info("Adding dependent charm {c}".format(c=c))
+                        log.info("Adding dependent charm %s", c)
                         charm_dep = get_charm(c,
                                               self.juju_state)
                         if not charm_dep.isolate:
@@ -358,6 +425,23 @@ class AddCharmDialog(Overlay):
         self.destroy()
 
 
+def _service_fingerprint(units, machines):
+    """ Returns the service state shown by a Node
+
+    :param list units: Unit() of the service
+    :param dict machines: Machine() by machine id
+    :rtype: tuple
+    """
+    fingerprint = []
+    for u in units:
+        m = machines.get(u.machine_id)
+        fingerprint.append((u.unit_name, u.agent_state, u.public_address,
+                            u.agent_state_info,
+                            m.agent_state if m else None,
+                            m.agent_state_info if m else None))
+    return tuple(sorted(fingerprint))
+
+
 class Node(WidgetWrap):
     """ A single ui node representation
     """
@@ -369,37 +453,74 @@ class Node(WidgetWrap):
         :param type: Service()
         """
         self.open_dialog = open_dialog
-
-        unit_info = []
-        for u in sorted(service.units, key=attrgetter('unit_name')):
-            info = "{unit_name} " \
-                   "({status})".format(unit_name=u.unit_name,
-                                       status=u.agent_state)
-
-            if u.public_address:
-                info += "\naddress: {address}".format(address=u.public_address)
-
-            if 'error' in u.agent_state:
-                state_info = u.agent_state_info.lstrip()
-                info += "\ninfo: {state_info}".format(state_info=state_info)
-
-            unit_machine = juju_state.machine(u.machine_id)
-            if unit_machine.agent_state is None and \
-               unit_machine.agent_state_info is not None:
-                info += "\nmachine info: " + unit_machine.agent_state_info
-
-            info += "\n\n"
-            unit_info.append(('weight', 2, Text(info)))
+        self._unit_names = []
+        self._unit_texts = {}
+        self._units = Columns([])
+        self.refresh(service, juju_state)
 
         # machines
         m = [
             (30, Text(service.service_name)),
-            Columns(unit_info)
+            self._units
         ]
 
         cols = Columns(m)
         self.__super.__init__(cols)
 
+    def refresh(self, service, juju_state):
+        """ Update unit information in place
+
+        Existing unit widgets are reused, the unit columns are only rebuilt
+        when units are added or removed.
+
+        :param service: charm service
+        :param type: Service()
+        """
+        units = sorted(service.units, key=attrgetter('unit_name'))
+        unit_info = [(u.unit_name,
+                      self._format_unit(u, juju_state.machine(u.machine_id)))
+                     for u in units]
+        for (unit_name, info) in unit_info:
+            text = self._unit_texts.get(unit_name)
+            if text is None:
+                self._unit_texts[unit_name] = Text(info)
+            elif text.text != info:
+                text.set_text(info)
+
+        unit_names = [unit_name for (unit_name, _) in unit_info]
+        if unit_names != self._unit_names:
+            for name in set(self._unit_names) - set(unit_names):
+                del self._unit_texts[name]
+            self._units.contents = [(self._unit_texts[name],
+                                     self._units.options('weight', 2))
+                                    for name in unit_names]
+            self._unit_names = unit_names
+
+    @staticmethod
+    def _format_unit(unit, unit_machine):
+        """ Text shown for a single unit
+
+        :param unit: service unit
+        :type unit: Unit()
+        :param unit_machine: machine the unit is deployed to
+        :type unit_machine: Machine()
+        :rtype: str
+        """
+        info = ["{unit_name} ({status})".format(unit_name=unit.unit_name,
+                                                status=unit.agent_state)]
+
+        if unit.public_address:
+            info.append("address: " + unit.public_address)
+
+        if 'error' in unit.agent_state:
+            info.append("info: " + unit.agent_state_info.lstrip())
+
+        if unit_machine.agent_state is None and \
+           unit_machine.agent_state_info is not None:
+            info.append("machine info: " + unit_machine.agent_state_info)
+
+        return "\n".join(info) + "\n\n"
+
     def selectable(self):
         return True
 
@@ -429,33 +550,78 @@ class ListWithHeader(Frame):
         return len(self._contents) > 0
 
     def update(self, nodes):
-        self._contents[:] = _wrap_focus(nodes)
+        """ Update the list in place, keeping the focus wrappers of nodes
+        that are already listed """
+        current = [w.original_widget for w in self._contents]
+        if len(current) == len(nodes) and \
+           all(a is b for a, b in zip(current, nodes)):
+            return
+        wrapped = dict((id(w.original_widget), w) for w in self._contents)
+        self._contents[:] = [wrapped[id(n)] if id(n) in wrapped
+                             else _wrap_focus(n) for n in nodes]
 
 
 class CommandRunner(ListBox):
-    def __init__(self):
+    """ Runs juju commands on a background worker so callers never block
+    the main loop """
+    def __init__(self, post_callback=None):
+        """ initialize
+
+        :param post_callback: (optional) hands (callback, result) to the main
+                              loop, see PegasusGUI.post_callback()
+        """
         self._contents = SimpleListWalker([])
         ListBox.__init__(self, self._contents)
         self.client = JujuClient()
+        self.post_callback = post_callback
+        self.command_q = Queue()
+        self.watch_commands()
 
-    def add_machine(self, constraints=None):
+    @utils.async
+    def watch_commands(self):
+        log.debug("Starting command runner watcher.")
+        while True:
+            func, args, callback = self.command_q.get()
+            out = None
+            try:
+                out = func(*args)
+            except Exception:
+                log.exception("ignoring exception in command runner.")
+            try:
+                if callback and self.post_callback:
+                    self.post_callback(callback, out)
+            except Exception:
+                log.exception("ignoring exception posting command result.")
+            finally:
+                self.command_q.task_done()
+
+    def add_machine(self, constraints=None, callback=None):
         """ Add a machine with optional constraints
 
+        The machine is added in the background, this returns immediately.
+
         :param dict constraints: (optional) machine specs
+        :param callback: (optional) called on the main loop with the output
+                         of the command, or None if it failed
         """
-        log.debug("adding machine with constraints={}".format(constraints))
-        out = self.client.add_machine(constraints)
-        return out
+        log.debug("adding machine with constraints=%s", constraints)
+        self.command_q.put((self.client.add_machine, (constraints,),
+                            callback))
 
-    def add_unit(self, service_name, machine_id=None, count=1):
+    def add_unit(self, service_name, machine_id=None, count=1,
+                 callback=None):
         """ Add a unit with optional machine id
 
+        The unit is added in the background, this returns immediately.
+
         :param str service_name: name of charm
         :param int machine_id: (optional) id of machine to deploy to
         :param int count: (optional) number of units to add
+        :param callback: (optional) called on the main loop with the output
+                         of the command, or None if it failed
         """
-        out = self.client.add_unit(service_name, machine_id, count)
-        return out
+        self.command_q.put((self.client.add_unit,
+                            (service_name, machine_id, count), callback))
 
 
 class NodeViewMode(Frame):
@@ -477,10 +643,15 @@ class NodeViewMode(Frame):
         self.juju_state = None
         self.maas_state = None
         self.nodes = ListWithHeader(NODE_HEADER)
+        self._nodes_by_name = {}
+        self._service_fingerprints = {}
+        # Units providing the footer urls, found by do_update()
+        self._horizon_unit = None
+        self._jujugui_unit = None
         self.loop = loop
         self.opts = opts
 
-        self.cr = CommandRunner()
+        self.cr = CommandRunner(loop.post_callback)
         Frame.__init__(self, header=header, body=self.nodes,
                        footer=footer)
         self.controller_overlay = ControllerOverlay(self, self.cr, self.opts)
@@ -535,15 +706,45 @@ class NodeViewMode(Frame):
                                    key=attrgetter('service_name'))
         deployed_service_names = [s.service_name for s in deployed_services]
 
-        charm_classes = sorted([m.__charm_class__ for m in utils.load_charms()
-                                if m.__charm_class__.charm_name in
-                                deployed_service_names],
+        charm_classes = sorted([c for c in _get_charm_classes()
+                                if c.charm_name in deployed_service_names],
                                key=attrgetter('charm_name'))
 
-        a = sorted([(c.display_priority, c.charm_name,
-                     Node(s, self.open_dialog, juju_state))
-                    for (c, s) in zip(charm_classes, deployed_services)])
-        nodes = [node for (_, _, node) in a]
+        # Reuse the Node widgets of known services and only create
+        # widgets for newly deployed ones. Nodes are left untouched when
+        # nothing they display has changed since the last poll.
+        machines = dict((m.machine_id, m) for m in juju_state.machines())
+        # Every service is scanned for the footer urls, the zip below skips
+        # services without a charm class.
+        self._horizon_unit = None
+        self._jujugui_unit = None
+        units_by_name = {}
+        for s in deployed_services:
+            units = list(s.units)
+            units_by_name[s.service_name] = units
+            for u in units:
+                if u.is_horizon:
+                    self._horizon_unit = u
+                if u.is_jujugui:
+                    self._jujugui_unit = u
+
+        a = []
+        for (c, s) in zip(charm_classes, deployed_services):
+            fingerprint = _service_fingerprint(units_by_name[s.service_name],
+                                               machines)
+            node = self._nodes_by_name.get(s.service_name)
+            if node is None:
+                node = Node(s, self.open_dialog, juju_state)
+                self._nodes_by_name[s.service_name] = node
+            elif self._service_fingerprints.get(s.service_name) != \
+                    fingerprint:
+                node.refresh(s, juju_state)
+            self._service_fingerprints[s.service_name] = fingerprint
+            a.append((c.display_priority, c.charm_name, node))
+        for name in set(self._nodes_by_name) - set(deployed_service_names):
+            del self._nodes_by_name[name]
+            del self._service_fingerprints[name]
+        nodes = [node for (_, _, node) in sorted(a, key=lambda x: x[:2])]
 
         if self.target == self.controller_overlay:
             continue_polling = self.controller_overlay.process(juju_state,
@@ -556,25 +757,25 @@ class NodeViewMode(Frame):
         self.status_info.set_text("[INFO] Polling node availability")
         self.juju_state, self.maas_state = state
         self.do_update(self.juju_state, self.maas_state)
-        for n in self.juju_state.services:
-            for i in n.units:
-                if i.is_horizon:
-                    url = "Horizon: "
-                    if i.public_address:
-                        url += "http://{}/horizon".format(i.public_address)
-                        self.status_info.set_text("[INFO] Nodes "
-                                                  "are accessible")
-                    else:
-                        url += "Pending"
-                        self.status_info.set_text("[INFO] Nodes "
-                                                  "are still deploying")
-                    self.horizon_url.set_text(url)
-                if i.is_jujugui:
-                    if i.public_address:
-                        url = "Juju-GUI: http://{}/".format(i.public_address)
-                    else:
-                        url = "Juju-GUI: Pending"
-                    self.jujugui_url.set_text(url)
+        i = self._horizon_unit
+        if i is not None:
+            url = "Horizon: "
+            if i.public_address:
+                url += "http://{}/horizon".format(i.public_address)
+                self.status_info.set_text("[INFO] Nodes "
+                                          "are accessible")
+            else:
+                url += "Pending"
+                self.status_info.set_text("[INFO] Nodes "
+                                          "are still deploying")
+            self.horizon_url.set_text(url)
+        i = self._jujugui_unit
+        if i is not None:
+            if i.public_address:
+                url = "Juju-GUI: http://{}/".format(i.public_address)
+            else:
+                url = "Juju-GUI: Pending"
+            self.jujugui_url.set_text(url)
         self.loop.draw_screen()
 
     def tick(self):
@@ -633,14 +834,29 @@ class PegasusGUI(MainLoop):
 
     def __init__(self, opts):
         self.opts = opts
-        self.cr = CommandRunner()
+        # Pick the event loop first, post_callback() may be used by the
+        # command runners before MainLoop is set up.
+        if asyncio is not None:
+            self._asyncio_loop = asyncio.get_event_loop()
+            event_loop = AsyncioEventLoop(loop=self._asyncio_loop)
+        else:
+            self._asyncio_loop = None
+            event_loop = None
+        self._init_pending_callbacks()
+        self.cr = CommandRunner(self.post_callback)
+        # Import the charm modules while juju is being polled below, so the
+        # first ControllerOverlay pass finds them cached.
+        _preload_charm_classes()
         self.node_view = NodeViewMode(self, self.opts)
         self.lock_ticks = 0  # start in a locked state
         self.locked = False
         self.juju_state, _ = pegasus.poll_state()
         self.init_machine()
         MainLoop.__init__(self, self.node_view.target, STYLES,
-                          unhandled_input=self._header_hotkeys)
+                          unhandled_input=self._header_hotkeys,
+                          event_loop=event_loop)
+        if self._asyncio_loop is None:
+            self._watch_pending_callbacks()
 
     @utils.async
     def init_machine(self):
@@ -711,41 +927,91 @@ class PegasusGUI(MainLoop):
     def run_async(self, f, callback):
         """ This is a little bit goofy. The urwid API is based on select(), and
         can't actually run python functions asynchronously. So, if we want to
-        run a long-running function which should update the UI, we have to get
-        a fd to have urwid watch for us, and then we send data to it when it's
-        done.
+        run a long-running function which should update the UI, we run it in a
+        thread and wake up the main loop through a pipe urwid watches for us
+        when it's done.
+
+        The pipe is created once, finished calls queue their result and only
+        write a byte to it if the main loop has not been woken up for earlier
+        results yet. When running on the asyncio event loop, f is
+        handed to the loop's executor instead and callback is invoked once the
+        future is done.
 
         FIXME: Once https://github.com/wardi/urwid/pull/57 is implemented.
         """
-
-        result = {'res': None}
-
-        # Here again things are a little weird: we own write_fd, but the urwid
-        # API makes things a bit awkward since we end up needing mutually
-        # recursive values, so we abuse python's scoping rules.
-        def done(unused):
-            try:
-                callback(result['res'])
-            except Exception:
-                log.warning(format_exc())
-            finally:
-                self.remove_watch_pipe(write_fd)
-                close(write_fd)
-
-        write_fd = self.watch_pipe(done)
+        if self._asyncio_loop is not None:
+            def future_done(future):
+                res = None
+                try:
+                    res = future.result()
+                except Exception:
+                    log.debug(format_exc())
+                self._run_callback(callback, res)
+
+            future = self._asyncio_loop.run_in_executor(None, f)
+            future.add_done_callback(future_done)
+            return
 
         def run_f():
-            ###################################################################
-            # FIXME: Because we are putting a dependency on python2
-            # for whatever reason using nonlocal is turning into a
-            # syntax error. I can only assume it has to do with the
-            # packaging somehow.
-            # nonlocal result
-            ###################################################################
+            res = None
             try:
-                result['res'] = f()
+                res = f()
             except Exception:
                 log.debug(format_exc())
-            write(write_fd, bytes('done', 'ascii'))
+            self.post_callback(callback, res)
 
         threading.Thread(target=run_f).start()
+
+    def post_callback(self, callback, res):
+        """ Calls callback(res) on the main loop
+
+        Safe to call from any thread.
+        """
+        if self._asyncio_loop is not None:
+            self._asyncio_loop.call_soon_threadsafe(self._run_callback,
+                                                    callback, res)
+            return
+
+        with self._pending_lock:
+            self._pending_callbacks.append((callback, res))
+            # Until the pipe is watched, results simply wait in the queue
+            # and are flushed by _watch_pending_callbacks().
+            fd = self._pending_fd
+            wakeup = fd is not None and not self._pending_wakeup
+            if wakeup:
+                self._pending_wakeup = True
+        if wakeup:
+            write(fd, b'\x01')
+
+    def _init_pending_callbacks(self):
+        # Results of background calls waiting to be handed to their
+        # callbacks on the main loop, see post_callback()
+        self._pending_callbacks = deque()
+        self._pending_lock = threading.Lock()
+        self._pending_wakeup = False
+        self._pending_fd = None
+
+    def _watch_pending_callbacks(self):
+        """ Starts watching the wakeup pipe of the select loop, waking it
+        up right away for results posted before that """
+        fd = self.watch_pipe(self._run_pending_callbacks)
+        with self._pending_lock:
+            self._pending_fd = fd
+            wakeup = len(self._pending_callbacks) > 0
+            self._pending_wakeup = wakeup
+        if wakeup:
+            write(fd, b'\x01')
+
+    def _run_pending_callbacks(self, unused_data):
+        with self._pending_lock:
+            pending = list(self._pending_callbacks)
+            self._pending_callbacks.clear()
+            self._pending_wakeup = False
+        for callback, res in pending:
+            self._run_callback(callback, res)
+
+    def _run_callback(self, callback, res):
+        try:
+            callback(res)
+        except Exception:
+            log.warning(format_exc())
@@ -47,8 +47,8 @@ class JujuState:
         :returns: machine
         :rtype: cloudinstall.machine.Machine()
         """
-        r = next(filter(lambda x: x.machine_id == machine_id,
-                 self.machines()), Machine(-1, {}))
+        r = next((x for x in self.machines() if x.machine_id == machine_id),
+                 Machine(-1, {}))
         return r
 
     def machines(self):
@@ -78,8 +78,8 @@ class JujuState:
         :returns: a service entry or None
         :rtype: Service()
         """
-        r = next(filter(lambda s: s.service_name == name,
-                        self.services), Service(name, {}))
+        r = next((s for s in self.services if s.service_name == name),
+                 Service(name, {}))
         return r
 
     @property
@@ -245,5 +245,4 @@ class MaasState:
         :returns: number of machines in `status`
         :rtype: int
         """
-        return len(list(filter(lambda m: int(m.status) == state,
-                               self.machines())))
+        return len([m for m in self.machines() if int(m.status) == state])
@@ -156,12 +156,8 @@ class Service:
         :returns: a Unit entry
         :rtype: Unit()
         """
-        def _match(unit):
-            if name in unit.unit_name:
-                return True
-            return False
-
-        return next(filter(_match, self.units), Unit('unknown', []))
+        return next((u for u in self.units if name in u.unit_name),
+                    Unit('unknown', []))
 
     @property
     def units(self):
@@ -180,8 +176,7 @@ class Service:
         :returns: a Relation entry
         :rtype: Relation()
         """
-        r = next(filter(lambda r: r.relation_name == name,
-                        self.relations),
+        r = next((r for r in self.relations if r.relation_name == name),
                  Relation('unknown', []))
         return r
 
@@ -107,7 +107,7 @@ def remote_cp(machine_id, src, dst):
 
 
 def remote_run(machine_id, cmds):
-    if type(cmds) is list:
+    if isinstance(cmds, (list, tuple)):
         cmds = " && ".join(cmds)
     log.debug("Remote running ({cmds}) on machine {m}".format(
         m=machine_id, cmds=cmds))
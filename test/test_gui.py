@@ -1,4 +1,6 @@
+import glob
 import sys
+import threading
 import unittest
 sys.path.insert(0, '../cloudinstall')
 
@@ -9,6 +11,8 @@ from cloudinstall import gui
 from cloudinstall import pegasus
 from cloudinstall.juju import JujuState
 from cloudinstall.maas import MaasState
+from cloudinstall.machine import Machine
+from cloudinstall.service import Unit
 
 import helpers
 import mock
@@ -194,3 +198,150 @@ def test_parse_pending_lxcs():
     with helpers.set_single_system(True):
         result = helpers.parse_output('pending')
         assert len(result) == 7
+
+
+def test_Node_format_unit():
+    unit = Unit('mysql/0', {'agent-state': 'error',
+                            'agent-state-info': ' hook failed',
+                            'public-address': '10.0.0.2',
+                            'machine': '1'})
+    machine = Machine('1', {'agent-state-info': 'no matching tools'})
+    assert gui.Node._format_unit(unit, machine) == \
+        "mysql/0 (error)\naddress: 10.0.0.2\ninfo: hook failed\n" \
+        "machine info: no matching tools\n\n"
+
+
+class FakeLoop(object):
+    widget = None
+    post_callback = None
+
+
+class FakeOpts(object):
+    enable_swift = False
+
+
+def _node_view(juju_state):
+    nvm = gui.NodeViewMode(FakeLoop(), FakeOpts())
+    nvm.controller_overlay.done = True
+    nvm.target = nvm
+    nvm.do_update(juju_state, None)
+    return nvm
+
+
+def _render(nvm):
+    return nvm.nodes.render((120, 40)).text
+
+
+def test_NodeViewMode_do_update_incremental():
+    outputs = sorted(glob.glob('test/juju-output/*.yaml') +
+                     glob.glob('test/juju-output/*.out'))
+    states = []
+    for fname in outputs:
+        with open(fname) as f:
+            states.append(JujuState(f.read()))
+
+    for before in states:
+        for after in states:
+            nvm = _node_view(before)
+            nvm.do_update(after, None)
+            assert _render(nvm) == _render(_node_view(after))
+
+
+def test_NodeViewMode_do_update_unchanged():
+    with open('test/juju-output/juju-status-single-install.yaml') as f:
+        raw = f.read()
+    nvm = _node_view(JujuState(raw))
+    wrappers = list(nvm.nodes._contents)
+    assert len(wrappers) > 0
+    nvm.do_update(JujuState(raw), None)
+    assert len(nvm.nodes._contents) == len(wrappers)
+    assert all(a is b for a, b in zip(nvm.nodes._contents, wrappers))
+
+
+class AddMachineRecorder(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def add_machine(self, constraints=None, callback=None):
+        self.callbacks.append(callback)
+
+
+def test_ControllerOverlay_add_machine_in_flight():
+    juju = JujuState("machines:\n"
+                     "  '0':\n"
+                     "    agent-state: started\n"
+                     "services: {}\n")
+    maas = MaasState([{'status': MaasState.READY,
+                       'hostname': 'node1.maas'}])
+    cr = AddMachineRecorder()
+    old_multi = pegasus.MULTI_SYSTEM
+    pegasus.MULTI_SYSTEM = True
+    try:
+        overlay = gui.ControllerOverlay(urwid.Text(""), cr, FakeOpts())
+        for _ in range(3):
+            assert overlay.process(juju, maas)
+        assert len(cr.callbacks) == 1
+
+        cr.callbacks[0]("created machine 1")
+        # first poll after the add-machine finished may be stale
+        assert overlay.process(juju, maas)
+        assert len(cr.callbacks) == 1
+
+        assert overlay.process(juju, maas)
+        assert len(cr.callbacks) == 2
+    finally:
+        pegasus.MULTI_SYSTEM = old_multi
+
+
+
+def _select_loop_gui():
+    loop = gui.PegasusGUI.__new__(gui.PegasusGUI)
+    loop._asyncio_loop = None
+    loop._init_pending_callbacks()
+    urwid.MainLoop.__init__(loop, urwid.SolidFill(),
+                            event_loop=urwid.SelectEventLoop())
+    loop._watch_pending_callbacks()
+    return loop
+
+
+def _run_select_loop(loop):
+    def stop():
+        raise urwid.ExitMainLoop()
+    loop.event_loop.alarm(0.2, stop)
+    try:
+        loop.event_loop.run()
+    except urwid.ExitMainLoop:
+        pass
+
+
+def _post_from_thread(loop, callback, res):
+    t = threading.Thread(target=loop.post_callback, args=(callback, res))
+    t.start()
+    t.join()
+
+
+def test_PegasusGUI_post_callback_pipe():
+    loop = _select_loop_gui()
+    results = []
+    for i in range(5):
+        _post_from_thread(loop, results.append, i)
+    assert results == []
+    _run_select_loop(loop)
+    assert results == [0, 1, 2, 3, 4]
+
+
+def test_PegasusGUI_post_callback_wakeups():
+    loop = _select_loop_gui()
+    results = []
+    with mock.patch('cloudinstall.gui.write', wraps=gui.write) as write:
+        for i in range(5):
+            _post_from_thread(loop, results.append, i)
+        # one wakeup for all results posted before the drain
+        assert write.call_count == 1
+        _run_select_loop(loop)
+        assert results == [0, 1, 2, 3, 4]
+
+        _post_from_thread(loop, results.append, 5)
+        assert write.call_count == 2
+        _run_select_loop(loop)
+        assert results == [0, 1, 2, 3, 4, 5]